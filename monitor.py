@@ -1,23 +1,62 @@
-import requests
-import hashlib
-import json
+import asyncio
+import base64
 import os
 import re
+import time
 import difflib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from bs4 import BeautifulSoup
+from pathlib import Path
+from urllib.parse import urljoin
+import httpx
+import orjson
+from blake3 import blake3
+import zstandard as zstd
 from dotenv import load_dotenv
-
-load_dotenv()
+from selectolax.lexbor import LexborHTMLParser
 
 DATA_FILE = "monitoring_data.json"
+MAX_CONCURRENT_FETCHES = 16
+HASH_DIGEST_SIZE = 16
+NOT_MODIFIED = object()
+
+_AVAILABILITY_PREFIX = "/tickets/tickets-availability/"
+
+EMBED_TITLE = "🎟️ TicketHelpLFC — Changes Detected"
+EMBED_FOOTER = "Website Monitor"
+MAX_EMBED_DESCRIPTION = 4096
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+EMBEDS_PER_MESSAGE_TARGET = 3
+# Sized so EMBEDS_PER_MESSAGE_TARGET full embeds fit in one message; diff snippets leave room for the header.
+EMBED_DESCRIPTION_BUDGET = MAX_EMBED_CHARS_PER_MESSAGE // EMBEDS_PER_MESSAGE_TARGET - len(EMBED_TITLE) - len(EMBED_FOOTER)
+DIFF_SNIPPET_CHARS = EMBED_DESCRIPTION_BUDGET - 400
+WEBHOOK_MAX_ATTEMPTS = 5
+
+_ZSTD_COMPRESSOR = zstd.ZstdCompressor(level=3)
+_ZSTD_DECOMPRESSOR = zstd.ZstdDecompressor()
+
+_TRAILING_ID = re.compile(r"-\d+$")
+_LFC = re.compile(r"\bliverpool\s+fc\b", re.IGNORECASE)
+_TIME = re.compile(r"^(\d{2})(\d{2})(am|pm)$")
+_SLUG_RE = re.compile(
+    r"^(?:(?P<teams>.*?)-)??(?P<day>\d+)-(?P<mon>jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)"
+    r"-(?P<year>\d{4})(?:-(?P<time>[^-]*)|$)",
+    re.IGNORECASE,
+)
+
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0"}
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+
+_client = None
 
 WEBSITES = [
     {
         "url": "https://www.liverpoolfc.com/tickets/tickets-availability",
         "name": "Liverpool FC Tickets",
         "discover_links": True,
-        "link_pattern": "/tickets/tickets-availability/",
+        "link_pattern": _AVAILABILITY_PREFIX,
     },
     {"url": "https://www.liverpoolfc.com/tickets/ticket-forwarding", "name": "Ticket Forwarding"},
     {"url": "https://legacy.liverpoolfc.com/tickets/premier-league-sale-dates", "name": "Premier League Sale Dates"},
@@ -27,29 +66,21 @@ WEBSITES = [
 
 def clean_match_title_from_slug(slug: str) -> str:
     slug = slug.strip("/").split("/")[-1]
-    slug = re.sub(r"-\d+$", "", slug)
-    parts = slug.split("-")
-    month_set = {"jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"}
-
-    date_idx = None
-    for i in range(len(parts) - 2):
-        if parts[i].isdigit() and parts[i + 1].lower() in month_set and parts[i + 2].isdigit() and len(parts[i + 2]) == 4:
-            date_idx = i
-            break
-    if date_idx is None:
+    slug = _TRAILING_ID.sub("", slug)
+    match = _SLUG_RE.match(slug)
+    if match is None:
         return slug.replace("-", " ").title()
 
-    teams_part = parts[:date_idx]
-    day = parts[date_idx]
-    mon = parts[date_idx + 1].title()
-    time_part = parts[date_idx + 3] if len(parts) > date_idx + 3 else ""
+    day = match["day"]
+    mon = match["mon"].title()
+    time_part = match["time"] or ""
 
-    teams_str = " ".join(teams_part).replace(" v ", " vs ").replace(" V ", " vs ")
-    teams_str = re.sub(r"\bliverpool\s+fc\b", "LFC", teams_str, flags=re.IGNORECASE)
+    teams_str = (match["teams"] or "").replace("-", " ").replace(" v ", " vs ").replace(" V ", " vs ")
+    teams_str = _LFC.sub("LFC", teams_str)
     teams_str = teams_str.title().replace("Lfc", "LFC")
 
     cleaned_time = time_part.lower()
-    m = re.match(r"^(\d{2})(\d{2})(am|pm)$", cleaned_time)
+    m = _TIME.match(cleaned_time)
     if m:
         hh = int(m.group(1))
         mm = m.group(2)
@@ -62,61 +93,110 @@ def clean_match_title_from_slug(slug: str) -> str:
 
 def load_previous_data():
     if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return orjson.loads(Path(DATA_FILE).read_bytes())
     return {}
 
 
 def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    Path(DATA_FILE).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+
+def pack_text(text: str) -> str:
+    return base64.b64encode(_ZSTD_COMPRESSOR.compress(text.encode("utf-8"))).decode("ascii")
+
+
+def unpack_text(entry: dict) -> str:
+    if "text_zstd" in entry:
+        return _ZSTD_DECOMPRESSOR.decompress(base64.b64decode(entry["text_zstd"])).decode("utf-8")
+    return entry.get("text", "")
 
 
 def normalize_text(html: str, selector: str | None = None) -> str:
-    soup = BeautifulSoup(html, "html.parser")
-    for tag in soup(["script", "style", "noscript"]):
+    tree = LexborHTMLParser(html)
+    for tag in tree.css("script, style, noscript"):
         tag.decompose()
 
-    if selector:
-        el = soup.select_one(selector)
-        text = el.get_text("\n", strip=True) if el else soup.get_text("\n", strip=True)
-    else:
-        text = soup.get_text("\n", strip=True)
+    el = tree.css_first(selector) if selector else None
+    text = (el or tree.root).text(separator="\n", strip=True)
 
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    return "\n".join(lines)
+    return "\n".join(s for ln in text.splitlines() if (s := ln.strip()))
 
 
-def get_page_text(url, selector=None):
-    try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        r = requests.get(url, headers=headers, timeout=30)
-        r.raise_for_status()
-        return normalize_text(r.text, selector)
-    except Exception as e:
-        print(f"Error fetching {url}: {e}")
-        return None
+def conditional_headers(entry: dict) -> dict:
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+async def fetch(client, url, semaphore, pool, selector=None, headers=None):
+    async with semaphore:
+        r = await client.get(url, headers=headers)
+    if r.status_code == 304:
+        return NOT_MODIFIED, r.headers
+    r.raise_for_status()
 
+    text = await asyncio.get_running_loop().run_in_executor(pool, normalize_text, r.text, selector)
+    return text, r.headers
 
-def sha256(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+async def fetch_all(pages):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    # forkserver: workers start on demand once the event loop and HTTP client threads are running.
+    with ProcessPoolExecutor(mp_context=multiprocessing.get_context("forkserver")) as pool:
+        async with httpx.AsyncClient(
+            headers=HTTP_HEADERS,
+            timeout=30,
+            follow_redirects=True,
+            transport=httpx.AsyncHTTPTransport(http2=True, retries=2, limits=HTTP_LIMITS),
+        ) as client:
+            coros = [fetch(client, url, semaphore, pool, selector, headers) for url, selector, headers in pages]
+            return await asyncio.gather(*coros, return_exceptions=True)
+
+
+def content_hash(s: str) -> str:
+    return blake3(s.encode("utf-8")).hexdigest(length=HASH_DIGEST_SIZE)
+
+
+def has_changed(entry: dict, h: str, text: str) -> bool:
+    if len(entry.get("hash", "")) == len(h):
+        return entry["hash"] != h
+    # Stored hash predates the BLAKE3 switch, so compare against the snapshot instead.
+    old_text = unpack_text(entry)
+    return bool(old_text) and old_text != text
+
+
+def get_client() -> httpx.Client:
+    # Built on first use so process-pool workers, which re-import this module, never open one.
+    global _client
+    if _client is None:
+        _client = httpx.Client(
+            headers=HTTP_HEADERS,
+            timeout=30,
+            follow_redirects=True,
+            transport=httpx.HTTPTransport(http2=True, retries=2, limits=HTTP_LIMITS),
+        )
+    return _client
 
 
 def discover_links(url, link_pattern):
     try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        r = requests.get(url, headers=headers, timeout=30)
+        r = get_client().get(url)
         r.raise_for_status()
-        soup = BeautifulSoup(r.text, "html.parser")
+        tree = LexborHTMLParser(r.text)
 
-        from urllib.parse import urljoin
+        query = f'a[href*="{link_pattern}"]' if link_pattern else "a[href]"
+        raw = [a.attributes.get("href") or "" for a in tree.css(query)]
 
         links = []
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
+        seen = set()
+        for href in raw:
             if href.startswith("/"):
                 href = urljoin(url, href)
-            if link_pattern in href and href not in links:
+            if href not in seen:
+                seen.add(href)
                 links.append(href)
         print(f"  Found {len(links)} matching links")
         return links
@@ -125,41 +205,114 @@ def discover_links(url, link_pattern):
         return []
 
 
-def send_discord_notification(message: str):
+def retry_after_seconds(r) -> float:
+    try:
+        return float(r.headers.get("Retry-After") or r.json().get("retry_after", 1))
+    except (ValueError, AttributeError):
+        # Not every 429 comes from Discord itself; a proxy error page has no JSON body.
+        return 1.0
+
+
+def post_webhook(webhook_url: str, payload: dict, wait_for_reset: bool = False) -> bool:
+    for attempt in range(1, WEBHOOK_MAX_ATTEMPTS + 1):
+        try:
+            r = get_client().post(webhook_url, json=payload, timeout=20)
+            if r.status_code == 429:
+                if attempt == WEBHOOK_MAX_ATTEMPTS:
+                    break
+                retry_after = retry_after_seconds(r)
+                print(f"  Discord rate limit hit, retrying in {retry_after:.1f}s")
+                time.sleep(retry_after)
+                continue
+            r.raise_for_status()
+        except Exception as e:
+            print(f"Failed to send Discord notification: {e}")
+            return False
+
+        # Wait out an exhausted bucket now rather than taking a 429 on the next batch.
+        if wait_for_reset and r.headers.get("X-RateLimit-Remaining") == "0":
+            time.sleep(float(r.headers.get("X-RateLimit-Reset-After", 1)))
+        return True
+
+    print("Failed to send Discord notification: still rate limited")
+    return False
+
+
+def send_discord_notification(descriptions: list[str]) -> bool:
     webhook_url = os.environ.get("DISCORD_WEBHOOK_URL")
     if not webhook_url:
         print("Discord webhook URL not set")
-        return
-
-    payload = {
-        "embeds": [{
-            "title": "🎟️ TicketHelpLFC — Changes Detected",
-            "description": message[:4096],
-            "color": 0x1E88E5,
-            "timestamp": datetime.utcnow().isoformat(),
-            "footer": {"text": "Website Monitor"},
-        }]
-    }
-
-    try:
-        r = requests.post(webhook_url, json=payload, timeout=20)
-        r.raise_for_status()
-        print("Discord notification sent")
-    except Exception as e:
-        print(f"Failed to send Discord notification: {e}")
-
-
-def diff_preview(old_text: str, new_text: str, max_lines: int = 200) -> str:
-    diff = list(difflib.unified_diff(
-        old_text.splitlines(),
-        new_text.splitlines(),
-        fromfile="before",
-        tofile="after",
-        lineterm=""
-    ))
-    if not diff:
-        return ""
-    return "\n".join(diff[:max_lines])
+        return False
+
+    timestamp = datetime.utcnow().isoformat()
+    embeds = [{
+        "title": EMBED_TITLE,
+        "description": d[:MAX_EMBED_DESCRIPTION],
+        "color": 0x1E88E5,
+        "timestamp": timestamp,
+        "footer": {"text": EMBED_FOOTER},
+    } for d in descriptions]
+
+    # Discord caps each message at 10 embeds and 6000 characters across all of them.
+    batches = []
+    batch, batch_chars = [], 0
+    for embed in embeds:
+        chars = len(EMBED_TITLE) + len(embed["description"]) + len(EMBED_FOOTER)
+        if batch and (len(batch) == MAX_EMBEDS_PER_MESSAGE or batch_chars + chars > MAX_EMBED_CHARS_PER_MESSAGE):
+            batches.append(batch)
+            batch, batch_chars = [], 0
+        batch.append(embed)
+        batch_chars += chars
+    if batch:
+        batches.append(batch)
+
+    sent = True
+    for i, batch in enumerate(batches):
+        if post_webhook(webhook_url, {"embeds": batch}, wait_for_reset=i < len(batches) - 1):
+            print(f"Discord notification sent ({len(batch)} embed(s))")
+        else:
+            sent = False
+    return sent
+
+
+def changed_region(old_lines: list[str], new_lines: list[str]) -> tuple[int, int, int]:
+    start = 0
+    limit = min(len(old_lines), len(new_lines))
+    while start < limit and old_lines[start] == new_lines[start]:
+        start += 1
+
+    old_end, new_end = len(old_lines), len(new_lines)
+    while old_end > start and new_end > start and old_lines[old_end - 1] == new_lines[new_end - 1]:
+        old_end -= 1
+        new_end -= 1
+    return start, old_end, new_end
+
+
+def diff_preview(old_text: str, new_text: str, max_lines: int = 200, positional: bool = False) -> str:
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+
+    if positional:
+        diff = list(difflib.unified_diff(
+            old_lines,
+            new_lines,
+            fromfile="before",
+            tofile="after",
+            lineterm=""
+        ))
+        return "\n".join(diff[:max_lines])
+
+    start, old_end, new_end = changed_region(old_lines, new_lines)
+    old_lines = old_lines[start:old_end]
+    new_lines = new_lines[start:new_end]
+    old_set = set(old_lines)
+    new_set = set(new_lines)
+    removed = [f"- {ln}" for ln in old_lines if ln not in new_set][:max_lines // 2]
+    added = [f"+ {ln}" for ln in new_lines if ln not in old_set][:max_lines // 2]
+    if not removed and not added and old_lines != new_lines:
+        # Lines were only swapped, moved or repeated, so show where they went.
+        return diff_preview("\n".join(old_lines), "\n".join(new_lines), max_lines, positional=True)
+    return "\n".join(removed + added)
 
 
 def monitor_websites():
@@ -186,58 +339,91 @@ def monitor_websites():
 
     print(f"\nMonitoring {len(urls_to_check)} total pages...\n")
 
-    for site in urls_to_check:
+    results = asyncio.run(fetch_all([
+        (s["url"], s.get("selector"), conditional_headers(previous.get(s["url"], {})))
+        for s in urls_to_check
+    ]))
+
+    checked_at = datetime.now().isoformat()
+    for site, result in zip(urls_to_check, results):
         url = site["url"]
         name = site["name"]
         selector = site.get("selector")
 
         print(f"Checking {name}...")
-        text = get_page_text(url, selector)
-        if text is None:
+        if isinstance(result, BaseException):
+            print(f"Error fetching {url}: {result}")
             continue
+        text, resp_headers = result
 
-        text_snap = text[:12000]
-        h = sha256(text_snap)
+        if text is NOT_MODIFIED:
+            current[url] = {**previous[url], "name": name, "last_checked": checked_at}
+            print(f"  Not modified: {name}")
+            continue
 
-        current[url] = {
+        text_snap = text[:12000]
+        h = content_hash(text_snap)
+        prev = previous.get(url)
+        changed = prev is not None and has_changed(prev, h, text_snap)
+        entry = {
             "name": name,
             "hash": h,
-            "last_checked": datetime.now().isoformat(),
+            "last_checked": checked_at,
             "selector": selector,
-            "text": text_snap,
+            "etag": resp_headers.get("ETag"),
+            "last_modified": resp_headers.get("Last-Modified"),
         }
 
-        if url in previous:
-            if previous[url].get("hash") != h:
-                old_text = previous[url].get("text", "")
-                changes.append({
-                    "name": name,
-                    "url": url,
-                    "previous_check": previous[url].get("last_checked", "Unknown"),
-                    "diff": diff_preview(old_text, text_snap),
-                })
-                print(f"✓ Change detected on {name}!")
-            else:
-                print(f"  No changes on {name}")
-        else:
+        if prev is not None and not changed and "text_zstd" in prev:
+            # Keep the already-compressed snapshot rather than re-packing identical text.
+            current[url] = {**prev, **entry}
+            print(f"  No changes on {name}")
+            continue
+
+        current[url] = {**entry, "text_zstd": pack_text(text_snap)}
+
+        if prev is None:
             print(f"  First time monitoring {name}")
+        elif changed:
+            changes.append({
+                "name": name,
+                "url": url,
+                "previous_check": prev.get("last_checked", "Unknown"),
+                "diff": diff_preview(unpack_text(prev), text_snap),
+            })
+            print(f"✓ Change detected on {name}!")
+        else:
+            print(f"  No changes on {name}")
 
     if changes:
-        msg = ""
+        descriptions = []
+        parts = []
+        running = 0
         for c in changes:
             url = c["url"]
-            display = c["name"]
-            if "/tickets/tickets-availability/" in url:
-                display = clean_match_title_from_slug(url.rstrip("/").split("/")[-1])
+            if _AVAILABILITY_PREFIX in url:
+                display = clean_match_title_from_slug(url.rstrip("/").rpartition("/")[2])
+            else:
+                display = c["name"]
 
-            msg += f"**{display}**\n🔗 {url}\n🕐 Prev: {c['previous_check']}\n"
+            block = f"**{display}**\n🔗 {url}\n🕐 Prev: {c['previous_check']}\n"
             if c["diff"]:
-                snippet = c["diff"][:3200]
-                msg += f"```diff\n{snippet}\n```\n"
-            msg += "\n"
-
-        send_discord_notification(msg)
-        print(f"\n{len(changes)} change(s) detected and notification sent!")
+                snippet = c["diff"][:DIFF_SNIPPET_CHARS]
+                block += f"```diff\n{snippet}\n```\n"
+            block += "\n"
+
+            if parts and running + len(block) > EMBED_DESCRIPTION_BUDGET:
+                descriptions.append("".join(parts))
+                parts = []
+                running = 0
+            parts.append(block)
+            running += len(block)
+
+        descriptions.append("".join(parts))
+        if send_discord_notification(descriptions):
+            print(f"\n{len(changes)} change(s) detected and notification sent!")
+        else:
+            print(f"\n{len(changes)} change(s) detected but the notification was not fully delivered")
     else:
         print("\nNo changes detected on any monitored websites")
 
@@ -245,4 +431,5 @@ def monitor_websites():
 
 
 if __name__ == "__main__":
+    load_dotenv()
     monitor_websites()